@@ -0,0 +1,216 @@
+"""
+fake_upstreams.py
+
+Local stand-ins for the AI21 segmentation, OpenAI embeddings and OpenAI completions APIs, with configurable latency,
+stragglers and error rates. Used to exercise server.py and the upstream client layer offline.
+
+All three services are served from one port:
+
+    POST /studio/v1/segmentation          AI21 (splits the text into ~120-word paragraphs)
+    POST .../embeddings                   OpenAI embeddings (deterministic hashed bag-of-words vectors)
+    POST .../completions                  OpenAI completions (answers from the first segment in the prompt)
+
+Point the backend at it with:
+
+    AI21_API_URL=http://127.0.0.1:8900/studio/v1 OPENAI_API_BASE=http://127.0.0.1:8900/v1 python3 server.py
+
+A latency profile is "base_ms[,jitter_ms[,straggler_rate,straggler_ms[,error_rate]]]", e.g. "300,50,0.05,4000"
+means 300 ms +/- 50 ms, with 5% of requests taking an extra 4 s.
+
+Usage:
+
+    python Developers/Benchmarks/fake_upstreams.py --port 8900 --completions 800,200,0.02,5000
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSION = 1536
+
+
+class LatencyProfile:
+    def __init__(self, base_ms=0.0, jitter_ms=0.0, straggler_rate=0.0, straggler_ms=0.0, error_rate=0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.straggler_rate = straggler_rate
+        self.straggler_ms = straggler_ms
+        self.error_rate = error_rate
+
+    @classmethod
+    def parse(cls, spec):
+        return cls(*[float(value) for value in spec.split(",")])
+
+    def sample_delay(self):
+        delay_ms = max(0.0, random.gauss(self.base_ms, self.jitter_ms)) if self.jitter_ms else self.base_ms
+        if random.random() < self.straggler_rate:
+            delay_ms += self.straggler_ms
+        return delay_ms / 1000
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+def hashed_embedding(text):
+    vector = [0.0] * EMBEDDING_DIMENSION
+    for word in re.findall(r"\w+", str(text).lower()):
+        digest = hashlib.md5(word.encode()).digest()
+        vector[int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSION] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def segment(text, max_words=120):
+    # paragraphs split at blank lines or every max_words words, roughly AI21-sized
+    segments = []
+    lines = []
+    words = 0
+    for line in text.split("\n") + [""]:
+        if line.strip():
+            lines.append(line)
+            words += len(line.split())
+        if lines and (not line.strip() or words >= max_words):
+            segments.append({"segmentText": "\n".join(lines).strip(), "segmentType": "normal_text"})
+            lines = []
+            words = 0
+    return segments
+
+
+def complete(prompt):
+    match = re.search(r'\n(\d+)\. "(.*)', prompt)
+    if not match:
+        return "Answer: I cannot answer the question with the given information."
+    first_sentence = match.group(2).split(".")[0][:200]
+    return f"Answer: {first_sentence}. <ID: {match.group(1)}>"
+
+
+class FakeUpstreams:
+    def __init__(self, port=0, ai21=None, embeddings=None, completions=None):
+        self.profiles = {
+            "ai21": ai21 or LatencyProfile(),
+            "embeddings": embeddings or LatencyProfile(),
+            "completions": completions or LatencyProfile(),
+        }
+        self.requests = {name: 0 for name in self.profiles}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def env(self):
+        # environment that points HandoutAssistant at these fakes
+        return {
+            "AI21_API_URL": f"http://127.0.0.1:{self.port}/studio/v1",
+            "OPENAI_API_BASE": f"http://127.0.0.1:{self.port}/v1",
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/segmentation"):
+                    service, respond = "ai21", lambda: {"segments": segment(body.get("source", ""))}
+                elif self.path.endswith("/embeddings"):
+                    service, respond = "embeddings", lambda: self.embeddings_response(body)
+                elif self.path.endswith("/completions"):
+                    service, respond = "completions", lambda: self.completions_response(body)
+                else:
+                    self.send_json(404, {"error": f"unknown path {self.path}"})
+                    return
+
+                with upstreams._lock:
+                    upstreams.requests[service] += 1
+                profile = upstreams.profiles[service]
+                time.sleep(profile.sample_delay())
+                if profile.should_fail():
+                    self.send_json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+                else:
+                    self.send_json(200, respond())
+
+            def embeddings_response(self, body):
+                inputs = body.get("input", [])
+                if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                    inputs = [inputs]
+                return {
+                    "object": "list",
+                    "model": body.get("model", "text-embedding-ada-002"),
+                    "data": [{"object": "embedding", "index": i, "embedding": hashed_embedding(text)}
+                             for i, text in enumerate(inputs)],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                }
+
+            def completions_response(self, body):
+                return {
+                    "id": "cmpl-fake",
+                    "object": "text_completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "text-davinci-003"),
+                    "choices": [{"text": complete(body.get("prompt", "")), "index": 0, "logprobs": None,
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up (deadline or losing hedge)
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def add_profile_arguments(parser):
+    for service in ("ai21", "embeddings", "completions"):
+        parser.add_argument(f"--{service}", type=LatencyProfile.parse, default=None, metavar="PROFILE",
+                            help=f"latency profile of the fake {service} service")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fake AI21 / OpenAI upstreams locally.")
+    parser.add_argument("--port", type=int, default=8900)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(args.port, args.ai21, args.embeddings, args.completions)
+    print(f"Fake upstreams listening on port {upstreams.port}")
+    for name, value in upstreams.env.items():
+        print(f"  {name}={value}")
+    try:
+        upstreams.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+import_time.py
+
+Checks that importing the backend modules stays within a start-up budget.
+
+Each module is imported in a fresh interpreter (so nothing is cached between runs) and the best of several runs
+is compared against the budget. The script exits with status 1 if any module is over budget, so it can be used
+as a regression check for accidentally re-introducing eager imports of langchain / openai / fitz / faiss.
+
+Usage (from the repository root):
+
+    python Developers/Benchmarks/import_time.py
+    python Developers/Benchmarks/import_time.py --budget-ms 150 --runs 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "PDF-Pilot_v1", "src")
+
+# module name -> default budget in milliseconds
+MODULES = {
+    "HandoutAssistant": 100,
+    "server": 400,
+}
+
+MODULES_THAT_MUST_STAY_LAZY = ["fitz", "openai", "langchain", "faiss", "requests", "transformers"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+eager = [name for name in {lazy!r} if name in sys.modules]
+print(elapsed * 1000)
+print(",".join(eager))
+"""
+
+
+def measure(module, runs):
+    timings = []
+    eager = []
+    for _ in range(runs):
+        probe = PROBE.format(module=module, lazy=MODULES_THAT_MUST_STAY_LAZY)
+        result = subprocess.run([sys.executable, "-c", probe], cwd=SRC_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+        lines = result.stdout.splitlines()
+        timings.append(float(lines[0]))
+        eager = [name for name in lines[1].split(",") if name] if len(lines) > 1 else []
+    return min(timings), eager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the PDF-Pilot backend modules.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module (best run is reported)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="override the per-module budget")
+    args = parser.parse_args()
+
+    over_budget = False
+    for module, default_budget in MODULES.items():
+        budget = args.budget_ms if args.budget_ms is not None else default_budget
+        best_ms, eager = measure(module, args.runs)
+        status = "OK" if best_ms <= budget and not eager else "FAIL"
+        print(f"{status:4}  {module:20} {best_ms:8.1f} ms  (budget {budget:.0f} ms)")
+        if eager:
+            print(f"      eagerly imported: {', '.join(eager)}")
+        if status == "FAIL":
+            over_budget = True
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
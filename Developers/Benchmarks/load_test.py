@@ -0,0 +1,330 @@
+"""
+load_test.py
+
+HTTP load test for server.py. Starts the fake AI21 / embeddings / completion services from fake_upstreams.py,
+starts server.py against them, drives '/chatbot' with a configurable number of concurrent users and reports
+throughput, p50/p95/p99 latency, error rates and the server's RSS over time.
+
+Documents are a weighted mix of the bundled handout.pdf and generated large PDFs; questions are drawn from
+Developers/PDF-example/QA-Test-Pairs.txt (fewer questions means more identical concurrent requests).
+
+Usage (from the repository root):
+
+    python Developers/Benchmarks/load_test.py --concurrency 16 --duration 60
+    python Developers/Benchmarks/load_test.py --concurrency 32 --large-weight 1 --large-pages 300 \\
+        --completions 800,200,0.02,5000 --retrieval local
+    python Developers/Benchmarks/load_test.py --server-cmd "gunicorn --preload -w 4 -b 127.0.0.1:{port} server:app" \\
+        --server-env PDF_PILOT_PRELOAD=1
+
+The default FAISS retrieval mode needs tiktoken's cl100k_base encoding, which tiktoken downloads on first use; on an
+offline machine pre-populate TIKTOKEN_CACHE_DIR or use --retrieval local.
+
+Latency profiles for --ai21, --embeddings and --completions use the fake_upstreams.py format
+"base_ms[,jitter_ms[,straggler_rate,straggler_ms[,error_rate]]]".
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import requests
+
+from fake_upstreams import FakeUpstreams, LatencyProfile, add_profile_arguments
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCHMARKS_DIR, "..", "..")
+SRC_DIR = os.path.join(REPO_DIR, "PDF-Pilot_v1", "src")
+EXAMPLE_DIR = os.path.join(REPO_DIR, "Developers", "PDF-example")
+
+WORDS = ("project team department committee proposal budget review quality compliance report evaluation "
+         "schedule risk stakeholder meeting milestone approval resource plan objective process policy").split()
+
+
+def load_questions(limit=None):
+    questions = []
+    with open(os.path.join(EXAMPLE_DIR, "QA-Test-Pairs.txt")) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("Q:"):
+                line = line[2:].strip()
+            if line.endswith("?") and line not in questions:
+                questions.append(line)
+    return questions[:limit] if limit else questions
+
+
+def generate_pdf(path, pages, seed):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        paragraphs = []
+        for _ in range(4):
+            sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))).capitalize() + "."
+                         for _ in range(rng.randint(3, 5))]
+            paragraphs.append(" ".join(sentences))
+        text = f"Section {page_number + 1}\n\n" + "\n\n".join(paragraphs)
+        page.insert_textbox(fitz.Rect(50, 50, 560, 790), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    # RSS in bytes of pid and all of its descendants (forked workers), from /proc, or psutil when available.
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            continue
+    return total or None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+class LoadTest:
+    def __init__(self, base_url, documents, questions, concurrency, duration, max_requests, timeout, server_pid,
+                 sample_interval):
+        self.base_url = base_url
+        self.documents = documents
+        self.questions = questions
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.server_pid = server_pid
+        self.sample_interval = sample_interval
+        self.results = []
+        self.samples = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._issued = 0
+
+    def next_request(self):
+        with self._lock:
+            if self._stop.is_set() or (self.max_requests and self._issued >= self.max_requests):
+                return None
+            self._issued += 1
+        names = [name for name, _, _ in self.documents]
+        weights = [weight for _, _, weight in self.documents]
+        name = random.choices(names, weights)[0]
+        data = next(data for doc_name, data, _ in self.documents if doc_name == name)
+        return name, data, random.choice(self.questions)
+
+    def user(self):
+        session = requests.Session()
+        while True:
+            request = self.next_request()
+            if request is None:
+                return
+            name, data, question = request
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{self.base_url}/chatbot", data={"question": question},
+                                        files={"file": (f"{name}.pdf", data, "application/pdf")}, timeout=self.timeout)
+                status = response.status_code
+                size = len(response.content)
+            except requests.RequestException as e:
+                status = type(e).__name__
+                size = 0
+            finished = time.perf_counter()
+            with self._lock:
+                self.results.append({"document": name, "status": status, "latency": finished - start,
+                                     "finished": finished, "response_bytes": size})
+
+    def sample(self, started):
+        while not self._stop.wait(self.sample_interval):
+            with self._lock:
+                completed = len(self.results)
+            self.samples.append({"elapsed": time.perf_counter() - started, "completed": completed,
+                                 "rss": process_tree_rss(self.server_pid)})
+
+    def run(self):
+        started = time.perf_counter()
+        self.samples.append({"elapsed": 0.0, "completed": 0, "rss": process_tree_rss(self.server_pid)})
+        sampler = threading.Thread(target=self.sample, args=(started,), daemon=True)
+        sampler.start()
+        timer = threading.Timer(self.duration, self._stop.set) if self.duration else None
+        if timer:
+            timer.start()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(self.user)
+        self._stop.set()
+        if timer:
+            timer.cancel()
+        sampler.join()
+        self.elapsed = time.perf_counter() - started
+        return self
+
+
+def report(test, upstreams, server_metrics):
+    results = test.results
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] * 1000 for r in ok]
+    statuses = Counter(str(r["status"]) for r in results)
+
+    print(f"\nrequests   {len(results)} in {test.elapsed:.1f} s  ({len(results) / test.elapsed:.2f} req/s, "
+          f"{len(ok) / test.elapsed:.2f} successful req/s)")
+    print(f"errors     {len(results) - len(ok)} ({(len(results) - len(ok)) / max(len(results), 1):.1%})  "
+          f"statuses {dict(statuses)}")
+    if latencies:
+        print(f"latency    p50 {percentile(latencies, 0.5):.0f} ms  p95 {percentile(latencies, 0.95):.0f} ms  "
+              f"p99 {percentile(latencies, 0.99):.0f} ms  max {max(latencies):.0f} ms")
+        print(f"response   {sum(r['response_bytes'] for r in ok) / len(ok):.0f} bytes on average")
+
+    print("\nper document")
+    for name in sorted({r["document"] for r in results}):
+        doc_latencies = [r["latency"] * 1000 for r in ok if r["document"] == name]
+        doc_errors = sum(1 for r in results if r["document"] == name and r["status"] != 200)
+        if doc_latencies:
+            print(f"  {name:12} {len(doc_latencies):6} ok  {doc_errors:4} errors  "
+                  f"p50 {percentile(doc_latencies, 0.5):7.0f} ms  p99 {percentile(doc_latencies, 0.99):7.0f} ms")
+        else:
+            print(f"  {name:12} {0:6} ok  {doc_errors:4} errors")
+
+    print("\nserver over time")
+    previous = None
+    for sample in test.samples:
+        rate = ""
+        if previous is not None:
+            rate = f"{(sample['completed'] - previous['completed']) / (sample['elapsed'] - previous['elapsed']):7.2f} req/s"
+        rss = f"{sample['rss'] / 1024 / 1024:8.1f} MB" if sample["rss"] else "     n/a"
+        print(f"  {sample['elapsed']:7.1f} s  {sample['completed']:6} done  RSS {rss}  {rate}")
+        previous = sample
+
+    print(f"\nupstream requests {upstreams.requests}")
+    if server_metrics:
+        print(f"server metrics    {json.dumps(server_metrics)}")
+
+
+def wait_for_server(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with status {process.returncode}")
+        try:
+            requests.get(f"{base_url}/metrics", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError("server.py did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test server.py against local fake upstreams.")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run (0 = until --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no limit)")
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout per request in seconds")
+    parser.add_argument("--questions", type=int, default=0, help="use only the first N questions (0 = all)")
+    parser.add_argument("--handout-weight", type=float, default=3, help="relative share of requests for handout.pdf")
+    parser.add_argument("--large-weight", type=float, default=1, help="relative share of requests for large PDFs")
+    parser.add_argument("--large-count", type=int, default=2, help="number of distinct generated large PDFs")
+    parser.add_argument("--large-pages", type=int, default=100, help="pages per generated large PDF")
+    parser.add_argument("--retrieval", choices=["faiss", "local"], default=None,
+                        help="PDF_PILOT_RETRIEVAL for the server")
+    parser.add_argument("--server-cmd", default=None,
+                        help="command to start the server ({port} is substituted), default: python server.py")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment variable for the server (repeatable)")
+    parser.add_argument("--sample-interval", type=float, default=2.0, help="seconds between RSS samples")
+    parser.add_argument("--json", default=None, help="also write raw results and samples to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    upstreams = FakeUpstreams(ai21=args.ai21 or LatencyProfile(300, 50),
+                              embeddings=args.embeddings or LatencyProfile(150, 30),
+                              completions=args.completions or LatencyProfile(800, 200)).start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        documents = []
+        with open(os.path.join(EXAMPLE_DIR, "handout.pdf"), "rb") as f:
+            documents.append(("handout", f.read(), args.handout_weight))
+        for i in range(args.large_count if args.large_weight else 0):
+            path = os.path.join(work_dir, f"large_{i}.pdf")
+            generate_pdf(path, args.large_pages, seed=args.seed + i)
+            with open(path, "rb") as f:
+                documents.append((f"large_{i}", f.read(), args.large_weight / args.large_count))
+        for name, data, weight in documents:
+            print(f"document {name:12} {len(data) / 1024:8.0f} KB  weight {weight:g}")
+
+        port = free_port()
+        env = dict(os.environ, PORT=str(port), **upstreams.env)
+        if args.retrieval:
+            env["PDF_PILOT_RETRIEVAL"] = args.retrieval
+        for setting in args.server_env:
+            name, _, value = setting.partition("=")
+            env[name] = value
+        command = shlex.split(args.server_cmd.format(port=port)) if args.server_cmd else [sys.executable, "server.py"]
+        log_path = os.path.join(work_dir, "server.log")
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        base_url = f"http://127.0.0.1:{port}"
+
+        try:
+            wait_for_server(base_url, server)
+            print(f"server pid {server.pid} on {base_url}, {args.concurrency} users, "
+                  f"{args.duration or 'unlimited'} s, {len(load_questions(args.questions))} questions")
+            test = LoadTest(base_url, documents, load_questions(args.questions), args.concurrency, args.duration,
+                            args.requests, args.timeout, server.pid, args.sample_interval).run()
+            try:
+                server_metrics = requests.get(f"{base_url}/metrics", timeout=5).json()
+            except (requests.RequestException, ValueError):
+                server_metrics = None
+            report(test, upstreams, server_metrics)
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump({"results": test.results, "samples": test.samples, "elapsed": test.elapsed,
+                               "upstream_requests": upstreams.requests, "server_metrics": server_metrics}, f)
+        except Exception:
+            with open(log_path) as log:
+                print("server log:\n" + log.read()[-4000:])
+            raise
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+upstream_tail_latency.py
+
+Exercises the upstream client layer (upstream.py) offline against fake_upstreams.py with injected delays and
+failures, and reports the latency percentiles and counters for each scenario:
+
+    baseline   no deadline/hedging benefit: hedging disabled, generous timeout
+    hedged     duplicate request after the recent p95 latency
+    deadline   short per-call deadline, stragglers become fast timeouts
+    outage     every request fails: retries, then the circuit breaker fails fast
+
+Usage (from the repository root):
+
+    python Developers/Benchmarks/upstream_tail_latency.py
+    python Developers/Benchmarks/upstream_tail_latency.py --calls 400 --concurrency 8 --straggler-rate 0.05
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "PDF-Pilot_v1", "src"))
+
+from fake_upstreams import FakeUpstreams, LatencyProfile  # noqa: E402
+from upstream import UpstreamClient, UpstreamError, UpstreamTimeout  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def run_scenario(name, client, url, calls, concurrency):
+    def one_call(i):
+        start = time.perf_counter()
+        try:
+            client.call(lambda timeout: post(url, timeout))
+            ok = True
+        except UpstreamError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one_call, range(calls)))
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    metrics = client.metrics()
+    print(f"{name:9} p50 {percentile(latencies, 0.5):7.0f} ms  p95 {percentile(latencies, 0.95):7.0f} ms  "
+          f"p99 {percentile(latencies, 0.99):7.0f} ms  max {max(latencies):7.0f} ms  errors {errors:4}  "
+          f"hedges {metrics['hedges']:4} (won {metrics['hedge_wins']})  retries {metrics['retries']:4}  "
+          f"rejected {metrics['rejected']:4}  circuit {metrics['circuit']}")
+
+
+def post(url, timeout):
+    try:
+        response = requests.post(url, json={"prompt": 'Question: ?\n1. "Fake segment."'}, timeout=timeout)
+    except requests.Timeout as e:
+        raise UpstreamTimeout(f"fake upstream timed out: {e}") from e
+    except requests.RequestException as e:
+        raise UpstreamError(f"fake upstream request failed: {e!r}") from e
+    if response.status_code != 200:
+        raise UpstreamError(f"fake upstream returned {response.status_code}")
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail latency of the upstream client against a fake upstream.")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--straggler-rate", type=float, default=0.03)
+    parser.add_argument("--straggler-ms", type=float, default=2000)
+    args = parser.parse_args()
+
+    profile = LatencyProfile(args.latency_ms, args.jitter_ms, args.straggler_rate, args.straggler_ms)
+    upstreams = FakeUpstreams(completions=profile).start()
+    url = f"http://127.0.0.1:{upstreams.port}/v1/completions"
+    print(f"fake completions: {args.latency_ms:.0f} +/- {args.jitter_ms:.0f} ms, "
+          f"{args.straggler_rate:.0%} stragglers +{args.straggler_ms:.0f} ms, {args.calls} calls x {args.concurrency}\n")
+
+    try:
+        run_scenario("baseline", UpstreamClient("baseline", timeout=30, hedge_quantile=None,
+                                                max_concurrency=args.concurrency * 2), url, args.calls, args.concurrency)
+        run_scenario("hedged", UpstreamClient("hedged", timeout=30, hedge_quantile=0.95,
+                                              max_concurrency=args.concurrency * 2), url, args.calls, args.concurrency)
+        deadline = (args.latency_ms + 4 * args.jitter_ms) * 4 / 1000
+        run_scenario("deadline", UpstreamClient("deadline", timeout=deadline, hedge_quantile=None, retries=0,
+                                                max_concurrency=args.concurrency * 2), url, args.calls, args.concurrency)
+
+        upstreams.profiles["completions"] = LatencyProfile(args.latency_ms, args.jitter_ms, error_rate=1.0)
+        run_scenario("outage", UpstreamClient("outage", timeout=5, backoff=0.05, failure_threshold=5,
+                                              reset_timeout=60, max_concurrency=args.concurrency * 2),
+                     url, args.calls, args.concurrency)
+    finally:
+        upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+vector_compression.py
+
+Reports the recall-vs-memory trade-off of the compressed vector storage modes in vector_index.py.
+
+Synthetic unit-norm embeddings with the same dimension as OpenAIEmbeddings (1536) are clustered around a number of
+"topics", and every query is a noisy copy of one of the stored vectors. Recall@k is measured against exact float32
+search, with and without exact re-ranking from the original vectors on disk.
+
+Usage (from the repository root):
+
+    python Developers/Benchmarks/vector_compression.py
+    python Developers/Benchmarks/vector_compression.py --vectors 20000 --queries 500 --k 2 --rerank 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "PDF-Pilot_v1", "src"))
+
+from vector_index import CompressedVectorIndex, STORAGE_MODES  # noqa: E402
+
+
+def synthetic_embeddings(count, dimension, topics, rng):
+    centers = rng.standard_normal((topics, dimension)).astype("float32")
+    vectors = centers[rng.integers(0, topics, count)] + 0.6 * rng.standard_normal((count, dimension)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(found_ids, true_ids):
+    hits = sum(len(set(found) & set(true)) for found, true in zip(found_ids, true_ids))
+    return hits / true_ids.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs memory of the compressed vector storage modes.")
+    parser.add_argument("--vectors", type=int, default=5000, help="number of stored segment embeddings")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=2, help="segments retrieved per question (HandoutAssistant uses 2)")
+    parser.add_argument("--rerank", type=int, default=4, help="candidate multiplier for the re-ranked runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = synthetic_embeddings(args.vectors, args.dimension, args.topics, rng)
+    queries = vectors[rng.integers(0, args.vectors, args.queries)]
+    queries = queries + 0.02 * rng.standard_normal(queries.shape).astype("float32")
+    documents = list(range(args.vectors))
+
+    exact = CompressedVectorIndex(vectors, documents, storage="flat")
+    _, true_ids = exact.search_vectors(queries, args.k)
+    flat_bytes = exact.memory_bytes()
+
+    print(f"{args.vectors} vectors x {args.dimension} dims, {args.queries} queries, recall@{args.k}\n")
+    print(f"{'storage':8} {'rerank':>6} {'bytes/vec':>10} {'compression':>12} {'recall':>8} {'ms/query':>9}")
+
+    with tempfile.TemporaryDirectory() as vectors_dir:
+        for storage in STORAGE_MODES:
+            for rerank in ([0] if storage == "flat" else [0, args.rerank]):
+                index = CompressedVectorIndex(vectors, documents, storage=storage, rerank=rerank, vectors_dir=vectors_dir)
+                start = time.perf_counter()
+                _, found_ids = index.search_vectors(queries, args.k)
+                elapsed_ms = (time.perf_counter() - start) * 1000 / args.queries
+                memory = index.memory_bytes()
+                print(f"{index.storage:8} {rerank:>6} {memory / args.vectors:>10.0f} {flat_bytes / memory:>11.1f}x "
+                      f"{recall(found_ids, true_ids):>8.3f} {elapsed_ms:>9.3f}")
+                index.close()
+
+
+if __name__ == "__main__":
+    main()
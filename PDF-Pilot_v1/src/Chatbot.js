@@ -12,6 +12,7 @@ import {
 } from '@mui/material';
 import { styled } from '@mui/system';
 import CloseIcon from '@mui/icons-material/Close';
+import HighlightedPage from './HighlightedPage';
 
 const StyledContainer = styled(Container)({
   display: 'flex',
@@ -41,13 +42,6 @@ const StyledAnswer = styled(Box)({
   textAlign: 'left',
 });
 
-const PDFViewer = styled('iframe')({
-  marginTop: '2rem',
-  minWidth: '100%',
-  minHeight: '50vh',
-  border: 'none',
-});
-
 const CloseButton = styled(IconButton)({
   position: 'absolute',
   right: '1rem',
@@ -60,7 +54,8 @@ const Chatbot = (props) => {
   const [answer, setAnswer] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [showPDF, setShowPDF] = useState(false);
-  const [pdfURL, setPdfURL] = useState('');
+  const [highlight, setHighlight] = useState(null);
+  const [downloadURL, setDownloadURL] = useState('');
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -70,6 +65,7 @@ const Chatbot = (props) => {
       const formData = new FormData();
       formData.append('question', question);
       formData.append('file', file);
+      formData.append('highlight_mode', 'rects');
 
       const response = await fetch(`http://${serverHost}:5001/chatbot`, {
         method: 'POST',
@@ -80,10 +76,20 @@ const Chatbot = (props) => {
         const jsonResponse = await response.json();
         setAnswer(jsonResponse.answer);
 
-        if (jsonResponse.highlighted_pdf_path) {
+        if (jsonResponse.highlights) {
           setShowPDF(true);
-          const pageNumber = jsonResponse.page_number || 1;
-          setPdfURL(`http://${serverHost}:5001/${jsonResponse.highlighted_pdf_path}#page=${pageNumber}`);
+          setHighlight({
+            pageNumber: jsonResponse.page_number || 1,
+            highlights: jsonResponse.highlights,
+            previewURL: jsonResponse.page_image_path
+              ? `http://${serverHost}:5001/${jsonResponse.page_image_path}`
+              : '',
+          });
+          const params = new URLSearchParams({
+            document_id: jsonResponse.document_id,
+            segment: jsonResponse.segment_key,
+          });
+          setDownloadURL(`http://${serverHost}:5001/download_highlighted_pdf?${params}`);
         }
       } else {
         console.error('Error:', response.status, response.statusText);
@@ -103,7 +109,8 @@ const Chatbot = (props) => {
 
   const handleClosePDF = () => {
     setShowPDF(false);
-    setPdfURL('');
+    setHighlight(null);
+    setDownloadURL('');
   };
 
   return (
@@ -144,12 +151,20 @@ const Chatbot = (props) => {
               <Typography>{answer}</Typography>
             </StyledAnswer>
           )}
-          {answer && showPDF && (
+          {answer && showPDF && highlight && (
             <>
               <CloseButton onClick={handleClosePDF}>
                 <CloseIcon />
               </CloseButton>
-              <PDFViewer key={pdfURL} src={pdfURL} />
+              <HighlightedPage
+                file={file}
+                pageNumber={highlight.pageNumber}
+                highlights={highlight.highlights}
+                previewURL={highlight.previewURL}
+              />
+              <Button variant="outlined" color="primary" href={downloadURL} sx={{ marginTop: '1rem' }}>
+                Download highlighted PDF
+              </Button>
             </>
           )}
         </StyledPaper>
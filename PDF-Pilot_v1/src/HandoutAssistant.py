@@ -1,14 +1,17 @@
 import os
-import fitz
-import json
-import requests
-import openai
+import io
 import re
-import pathlib
-import langchain
-import faiss
-from langchain.docstore.document import Document
-from langchain.embeddings.openai import OpenAIEmbeddings
+import math
+import time
+import threading
+from contextlib import contextmanager
+from cache import LRUCache
+from singleflight import SingleFlight
+from upstream import UpstreamError, UpstreamTimeout, get_upstream
+
+# fitz, requests, openai and langchain are imported inside the methods that
+# use them, so importing this module (and starting server.py) stays cheap.
+# Call HandoutAssistant.preload() to pay that cost up front instead.
 
 
 #ADD API-KEYs PLEASE !!!
@@ -16,22 +19,64 @@ os.environ["OPENAI_API_KEY"] = "YOUR-OPENAI-API-KEY-HERE"
 os.environ["AI21_API_KEY"] = "YOUR-AI21-Studio-API-KEY-HERE"
 
 
+class InvalidPDFError(ValueError):
+    pass
+
+
 class PDFHandler:
+    @staticmethod
+    def open_pdf(pdf):
+        # Accepts a file path, the raw bytes of a PDF or an in-memory
+        # io.BytesIO (opened without copying its buffer). Raises
+        # InvalidPDFError for empty, unreadable or page-less documents.
+        import fitz
+        try:
+            if isinstance(pdf, (bytes, bytearray, memoryview)):
+                doc = fitz.open(stream=pdf, filetype="pdf")
+            elif isinstance(pdf, io.BytesIO):
+                doc = fitz.open(stream=pdf.getbuffer(), filetype="pdf")
+            else:
+                doc = fitz.open(pdf)
+        except fitz.FileDataError as e:
+            raise InvalidPDFError(f"Not a readable PDF: {e}") from e
+        if doc.page_count == 0:
+            doc.close()
+            raise InvalidPDFError("PDF has no pages")
+        return doc
+
+    @staticmethod
+    @contextmanager
+    def document(pdf):
+        # Yields an opened fitz.Document. An already opened document is passed
+        # through and left open, so one parse can be shared by text extraction
+        # and highlighting; anything else is opened here and closed on exit.
+        import fitz
+        if isinstance(pdf, fitz.Document):
+            yield pdf
+            return
+        doc = PDFHandler.open_pdf(pdf)
+        try:
+            yield doc
+        finally:
+            doc.close()
+
     @staticmethod
     def pdf_to_text(pdf_path):
-        doc = fitz.open(pdf_path)
         text = ""
         page_texts = []
-        for page in doc:
-            page_text = page.get_text("text")
-            text += page_text
-            page_texts.append({"text": page_text, "page_number": page.number})
+        with PDFHandler.document(pdf_path) as doc:
+            for page in doc:
+                page_text = page.get_text("text")
+                text += page_text
+                page_texts.append({"text": page_text, "page_number": page.number})
         return text, page_texts
 
     @staticmethod
     def highlight_text(input_pdf, output_pdf, text_to_highlight):
+        # output_pdf may be a path or a writable file object. The annotations
+        # are added to input_pdf itself when it is an opened document.
         phrases = text_to_highlight.split('\n')
-        with fitz.open(input_pdf) as doc:
+        with PDFHandler.document(input_pdf) as doc:
             for page in doc:
                 for phrase in phrases:
                     areas = page.search_for(phrase)
@@ -41,10 +86,58 @@ class PDFHandler:
                             highlight.update()
             doc.save(output_pdf)
 
+    @staticmethod
+    def find_highlights(input_pdf, text_to_highlight):
+        # Same search as highlight_text, but only returns the matched
+        # rectangles (x0, y0, x1, y1 in PDF points, origin top-left) per page,
+        # so a client can draw them over the PDF it already has.
+        phrases = [phrase for phrase in text_to_highlight.split('\n') if phrase.strip()]
+        highlights = []
+        with PDFHandler.document(input_pdf) as doc:
+            for page in doc:
+                rects = []
+                for phrase in phrases:
+                    for area in page.search_for(phrase):
+                        rects.append([round(area.x0, 1), round(area.y0, 1), round(area.x1, 1), round(area.y1, 1)])
+                if rects:
+                    highlights.append({
+                        "page_number": page.number + 1,
+                        "width": round(page.rect.width, 1),
+                        "height": round(page.rect.height, 1),
+                        "rects": rects
+                    })
+        return highlights
+
+    @staticmethod
+    def render_page(input_pdf, page_number, text_to_highlight=None, dpi=110, image_format="png"):
+        # Renders one page (1-based), with text_to_highlight highlighted, to
+        # PNG or WebP bytes. WebP needs Pillow.
+        with PDFHandler.open_pdf(input_pdf) as doc:
+            page = doc[page_number - 1]
+            if text_to_highlight:
+                for phrase in text_to_highlight.split('\n'):
+                    if phrase.strip():
+                        for area in page.search_for(phrase):
+                            page.add_highlight_annot(area).update()
+            pix = page.get_pixmap(dpi=dpi, annots=True)
+            if image_format == "webp":
+                return pix.pil_tobytes(format="WEBP", quality=80)
+            return pix.tobytes("png")
+
 class AI21Segmentation:
     @staticmethod
     def segment_text(text):
-        url = "https://api.ai21.com/studio/v1/segmentation"
+        # Falls back to local paragraph splitting while AI21 is unavailable.
+        # Not hedged: latency grows with the document, so large documents
+        # would always look slower than the recent p95.
+        upstream = get_upstream("ai21", timeout=60.0, hedge_quantile=None)
+        return upstream.call(lambda timeout: AI21Segmentation.request_segments(text, timeout),
+                             fallback=lambda error: AI21Segmentation.local_segments(text, error))
+
+    @staticmethod
+    def request_segments(text, timeout):
+        import requests
+        url = os.environ.get("AI21_API_URL", "https://api.ai21.com/studio/v1") + "/segmentation"
         payload = {
             "sourceType": "TEXT",
             "source": text
@@ -54,28 +147,99 @@ class AI21Segmentation:
             "content-type": "application/json",
             "Authorization": f"Bearer {os.environ['AI21_API_KEY']}"
         }
-        response = requests.post(url, json=payload, headers=headers)
+        try:
+            response = requests.post(url, json=payload, headers=headers, timeout=timeout)
+        except requests.Timeout as e:
+            raise UpstreamTimeout(f"AI21 segmentation timed out: {e}") from e
+        except requests.RequestException as e:
+            raise UpstreamError(f"AI21 segmentation request failed: {e!r}") from e
         if response.status_code == 200:
             json_response = response.json()
             return json_response.get("segments")
         else:
             print(f"An error occurred: {response.status_code}")
-            return None
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise UpstreamError(f"AI21 segmentation returned {response.status_code}", retryable=retryable)
+
+    @staticmethod
+    def local_segments(text, error=None, max_words=120):
+        # Groups lines into paragraphs (split at blank lines or every
+        # max_words words); used while AI21 is unavailable, in which case the
+        # segments are marked "fallback" so they are not cached for long.
+        if error is not None:
+            print(f"AI21 segmentation failed ({error}), splitting paragraphs locally")
+        segments = []
+        lines = []
+        words = 0
+        for line in text.split("\n") + [""]:
+            if line.strip():
+                lines.append(line)
+                words += len(line.split())
+            if lines and (not line.strip() or words >= max_words):
+                segments.append({"segmentText": "\n".join(lines).strip(), "segmentType": "normal_text"})
+                lines = []
+                words = 0
+        if error is not None:
+            for segment in segments:
+                segment["fallback"] = True
+        return segments
 
 class OpenAIAPI:
     def __init__(self):
-        openai.api_key = os.environ["OPENAI_API_KEY"]
+        self.api_key = os.environ["OPENAI_API_KEY"]
+        # Last answers by prompt, served while OpenAI is unavailable.
+        self.answers = LRUCache(maxsize=int(os.environ.get("PDF_PILOT_ANSWER_CACHE_SIZE", 1024)))
 
     def get_answer_and_id(self, prompt):
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=prompt,
-            temperature=0.5,
-            max_tokens=2000,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0
-        )
+        def fallback(error):
+            cached = self.answers.get(prompt)
+            if cached is None:
+                raise error
+            return cached
+
+        upstream = get_upstream("openai-completions", timeout=60.0)
+        answer = upstream.call(lambda timeout: self.request_answer_and_id(prompt, timeout), fallback=fallback)
+        self.answers.set(prompt, answer)
+        return answer
+
+    @staticmethod
+    @contextmanager
+    def upstream_errors(service):
+        # Maps OpenAI API errors to UpstreamError: timeouts, connection
+        # errors, 429 and 5xx can be retried, other 4xx responses (bad key,
+        # oversized prompt, ...) cannot. Errors that did not come from the
+        # API (e.g. a misconfigured client) are left as they are.
+        import openai
+        try:
+            yield
+        except openai.error.Timeout as e:
+            raise UpstreamTimeout(f"{service} timed out: {e}") from e
+        except openai.error.OpenAIError as e:
+            if isinstance(e, (openai.error.InvalidAPIType, openai.error.SignatureVerificationError)):
+                raise
+            client_errors = (openai.error.AuthenticationError, openai.error.PermissionError,
+                             openai.error.InvalidRequestError)
+            status = e.http_status
+            if status is not None:
+                retryable = status == 429 or status >= 500
+            else:
+                retryable = not isinstance(e, client_errors)
+            raise UpstreamError(f"{service} request failed ({status}): {e}", retryable=retryable) from e
+
+    def request_answer_and_id(self, prompt, timeout):
+        import openai
+        openai.api_key = self.api_key
+        with self.upstream_errors("OpenAI completions"):
+            response = openai.Completion.create(
+                engine="text-davinci-003",
+                prompt=prompt,
+                temperature=0.5,
+                max_tokens=2000,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0,
+                request_timeout=timeout
+            )
         answer_text = response.choices[0].text.strip()
         lines = response.choices[0].text.strip().split('\n')
         answer = lines[0].strip()
@@ -87,13 +251,186 @@ class OpenAIAPI:
             segment_id = None
         return answer, segment_id
 
+class UpstreamEmbeddings:
+    # Sends embedding requests through UpstreamClients; usable wherever
+    # langchain expects an Embeddings object. Queries and whole-document
+    # batches use separate clients so the batches (slower, and not hedged)
+    # do not share the queries' latency statistics.
+    def __init__(self, embedder, query_upstream, batch_upstream):
+        self.embedder = embedder
+        self.query_upstream = query_upstream
+        self.batch_upstream = batch_upstream
+
+    def with_timeout(self, timeout):
+        return self.embedder.copy(update={"request_timeout": timeout})
+
+    def embed_documents(self, texts):
+        def embed(timeout):
+            with OpenAIAPI.upstream_errors("OpenAI embeddings"):
+                return self.with_timeout(timeout).embed_documents(texts)
+        return self.batch_upstream.call(embed)
+
+    def embed_query(self, text):
+        def embed(timeout):
+            with OpenAIAPI.upstream_errors("OpenAI embeddings"):
+                return self.with_timeout(timeout).embed_query(text)
+        return self.query_upstream.call(embed)
+
+class LexicalIndex:
+    # Cheap IDF-weighted word-overlap index used to pre-filter segments
+    # before running the local QA model over them.
+    def __init__(self, questions_data):
+        self.segments = questions_data
+        self.segment_terms = [set(self.tokenize(q_data["segmentText"])) for q_data in questions_data]
+        document_frequency = {}
+        for terms in self.segment_terms:
+            for term in terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        total = len(questions_data)
+        self.idf = {term: math.log(1 + total / count) for term, count in document_frequency.items()}
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"\w+", text.lower())
+
+    def search(self, question, k):
+        question_terms = set(self.tokenize(question))
+        scored = []
+        for q_data, terms in zip(self.segments, self.segment_terms):
+            score = sum(self.idf[term] for term in question_terms & terms)
+            if score > 0:
+                scored.append((score, q_data))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [q_data for _, q_data in scored[:k]]
+
+class LocalQARetriever:
+    # CPU retrieval mode: lexical pre-filter, then the extractive QA model is
+    # run over the surviving candidates in padded batches, best candidates
+    # first, stopping as soon as enough of them clear the score threshold.
+    def __init__(self, model="distilbert-base-cased-distilled-squad", batch_size=8, num_threads=None,
+                 score_threshold=0.5, max_candidates=16, top_k=2):
+        self.model = model
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.score_threshold = score_threshold
+        self.max_candidates = max_candidates
+        self.top_k = top_k
+        self._nlp = None
+        self._nlp_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        num_threads = os.environ.get("PDF_PILOT_QA_THREADS")
+        return cls(
+            model=os.environ.get("PDF_PILOT_QA_MODEL", "distilbert-base-cased-distilled-squad"),
+            batch_size=int(os.environ.get("PDF_PILOT_QA_BATCH_SIZE", 8)),
+            num_threads=int(num_threads) if num_threads else None,
+            score_threshold=float(os.environ.get("PDF_PILOT_QA_SCORE_THRESHOLD", 0.5)),
+            max_candidates=int(os.environ.get("PDF_PILOT_QA_CANDIDATES", 16)),
+        )
+
+    @property
+    def nlp(self):
+        # Built once; concurrent first requests wait for the same pipeline.
+        with self._nlp_lock:
+            if self._nlp is None:
+                import torch
+                from transformers import pipeline
+                if self.num_threads:
+                    torch.set_num_threads(self.num_threads)
+                self._nlp = pipeline("question-answering", model=self.model, device=-1)
+        return self._nlp
+
+    def get_relevant_segments(self, questions_data, user_question, lexical_index):
+        candidates = lexical_index.search(user_question, self.max_candidates)
+
+        relevant_segments = []
+        for start in range(0, len(candidates), self.batch_size):
+            batch = candidates[start:start + self.batch_size]
+            responses = self.nlp(
+                question=[user_question] * len(batch),
+                context=[q_data["segmentText"] for q_data in batch],
+                batch_size=self.batch_size,
+            )
+            if isinstance(responses, dict):
+                responses = [responses]
+
+            for q_data, response in zip(batch, responses):
+                if response["score"] > self.score_threshold:
+                    relevant_segments.append({
+                        "id": q_data["id"],
+                        "segment_text": q_data["segmentText"],
+                        "score": response["score"],
+                        "page_number": q_data["page_number"]
+                    })
+
+            if len(relevant_segments) >= self.top_k:
+                break
+
+        relevant_segments.sort(key=lambda x: x["score"], reverse=True)
+        return relevant_segments[:self.top_k]
+
 class HandoutAssistant:
-    def __init__(self):
+    def __init__(self, retrieval_mode=None):
         self.openai_api = OpenAIAPI()
-        self.current_pdf_path = None
-        self.questions_data = None
-        self.embedder = OpenAIEmbeddings()
-
+        self._embedder = None
+
+        # Processed documents ({"questions_data", "index", "expires_at"}) by document id.
+        self.documents = LRUCache(maxsize=int(os.environ.get("PDF_PILOT_MAX_DOCUMENTS", 32)),
+                                  on_evict=lambda document_id, document: self.close_index(document["index"]))
+
+        # "flat" keeps langchain's float32 FAISS store; "fp16", "sq8" or "pq"
+        # store compressed vectors (see vector_index.CompressedVectorIndex).
+        self.vector_storage = os.environ.get("PDF_PILOT_VECTOR_STORAGE", "flat")
+        # Concurrent requests for the same document / question share one
+        # ingestion and one completion instead of each calling the APIs.
+        self.ingestions = SingleFlight()
+        self.answers = SingleFlight()
+        self.wait_timeout = float(os.environ.get("PDF_PILOT_SINGLEFLIGHT_TIMEOUT", 120))
+        # Documents segmented locally while AI21 was unavailable are only
+        # cached this long (seconds), then ingested again.
+        self.fallback_ttl = float(os.environ.get("PDF_PILOT_FALLBACK_DOCUMENT_TTL", 60))
+
+        # "faiss" (OpenAI embeddings, default) or "local" (CPU QA model, no embedding calls)
+        self.retrieval_mode = retrieval_mode or os.environ.get("PDF_PILOT_RETRIEVAL", "faiss")
+        self.local_qa = LocalQARetriever.from_env() if self.retrieval_mode == "local" else None
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            from langchain.embeddings.openai import OpenAIEmbeddings
+            # retries are left to the upstream clients
+            self._embedder = UpstreamEmbeddings(
+                OpenAIEmbeddings(max_retries=0),
+                get_upstream("openai-embeddings", timeout=60.0),
+                get_upstream("openai-embeddings-batch", timeout=120.0, hedge_quantile=None))
+        return self._embedder
+
+    def preload(self):
+        # Import every backend and build the embedder (or the local QA model)
+        # now. Used by server.py in preload mode so forked workers inherit an
+        # initialized assistant.
+        import fitz
+        import requests
+        import openai
+        if self.local_qa is not None:
+            self.local_qa.nlp
+        else:
+            import faiss
+            import langchain
+            from langchain.docstore.document import Document
+            if self.vector_storage != "flat":
+                import numpy
+                import vector_index
+            self.embedder
+            try:
+                # OpenAIEmbeddings loads (and on first use downloads) its
+                # tokenizer lazily; tiktoken caches it per process.
+                import tiktoken
+                tiktoken.encoding_for_model(self.embedder.embedder.model)
+            except Exception as e:
+                print(f"Could not preload the tiktoken encoding: {e!r}")
+        return self
 
     def process_pdf(self, pdf_path):
         text, page_texts = PDFHandler.pdf_to_text(pdf_path)
@@ -120,21 +457,32 @@ class HandoutAssistant:
         return segmented_text
 
     def build_faiss_index(self, questions_data):
+        import langchain
+        from langchain.docstore.document import Document
+
         # Convert questions_data to a list of Documents
         documents = [Document(page_content=q_data["segmentText"], metadata={"id": q_data["id"], "page_number": q_data["page_number"]}) for q_data in questions_data]
 
 
+        if self.vector_storage != "flat":
+            from vector_index import CompressedVectorIndex
+            return CompressedVectorIndex.from_env(documents, self.embedder)
+
         # Create the FAISS index (vector store) using the langchain.FAISS.from_documents() method
         vector_store = langchain.FAISS.from_documents(documents, self.embedder)
 
         return vector_store
 
+    @staticmethod
+    def close_index(index):
+        # Compressed indexes may keep their original vectors on disk.
+        if hasattr(index, "close"):
+            index.close()
 
-    def get_relevant_segments(self, questions_data, user_question, faiss_index):
-        retriever = faiss_index.as_retriever()
-        retriever.search_kwargs = {"k": 2}
 
-        docs = retriever.get_relevant_documents(user_question)
+    def get_relevant_segments(self, questions_data, user_question, faiss_index):
+        # similarity_search is implemented by both langchain.FAISS and CompressedVectorIndex
+        docs = faiss_index.similarity_search(user_question, k=2)
 
         relevant_segments = []
         for doc in docs:
@@ -172,16 +520,66 @@ Relevant Segments:"""
             print(f"Relevant Element ID: {segment['id']}")  # Add this line to print the relevant element IDs
         return prompt
 
-    def process_pdf_and_get_answer(self, pdf_path, question):
-        if pdf_path != self.current_pdf_path:
-            self.current_pdf_path = pdf_path
-            self.questions_data = self.process_pdf(pdf_path)
+    @staticmethod
+    def normalize_question(question):
+        return " ".join(question.lower().split()).rstrip("?!. ")
 
-            # Build the FAISS index (vector store)
-            self.faiss_index = self.build_faiss_index(self.questions_data)
+    def cached_document(self, document_id):
+        document = self.documents.get(document_id)
+        if document is not None and document["expires_at"] is not None and time.monotonic() >= document["expires_at"]:
+            return None
+        return document
+
+    def load_document(self, pdf_path, document_id):
+        document = self.cached_document(document_id)
+        if document is not None:
+            return document
+
+        def ingest():
+            # A caller that missed the cache just before the previous flight
+            # stored its result may only enter do() after that flight ended.
+            document = self.cached_document(document_id)
+            if document is not None:
+                return document
+            questions_data = self.process_pdf(pdf_path)
+            if self.local_qa is not None:
+                index = LexicalIndex(questions_data)
+            else:
+                # Build the FAISS index (vector store)
+                index = self.build_faiss_index(questions_data)
+            fallback = any(q_data.get("fallback") for q_data in questions_data)
+            document = {
+                "questions_data": questions_data,
+                "index": index,
+                "expires_at": time.monotonic() + self.fallback_ttl if fallback else None,
+            }
+            # Cache before the flight ends so callers arriving later hit the cache.
+            expired = self.documents.get(document_id)
+            self.documents.set(document_id, document)
+            if expired is not None:
+                # replaced, not evicted, so the LRU does not close it
+                self.close_index(expired["index"])
+            return document
+
+        return self.ingestions.do(document_id, ingest, timeout=self.wait_timeout)
+
+    def process_pdf_and_get_answer(self, pdf_path, question, document_id=None):
+        # pdf_path may also be bytes or an opened fitz.Document, in which case
+        # document_id (e.g. a content hash) identifies it for caching.
+        document_id = document_id or pdf_path
+        document = self.load_document(pdf_path, document_id)
+        return self.answers.do(
+            (document_id, self.normalize_question(question)),
+            lambda: self.answer_question(document["questions_data"], document["index"], question),
+            timeout=self.wait_timeout,
+        )
 
+    def answer_question(self, questions_data, index, question):
         # Use the retriever to search for the most relevant segments
-        relevant_segments = self.get_relevant_segments(self.questions_data, question, self.faiss_index)
+        if self.local_qa is not None:
+            relevant_segments = self.local_qa.get_relevant_segments(questions_data, question, index)
+        else:
+            relevant_segments = self.get_relevant_segments(questions_data, question, index)
 
         if not relevant_segments:
             return "I couldn't find enough relevant information to answer your question.", None, None, None
@@ -194,7 +592,7 @@ Relevant Segments:"""
         if segment_id is not None:
             segment_data = next((seg for seg in relevant_segments if seg["id"] == segment_id), None)
             segment_text = segment_data["segment_text"] if segment_data else None
-            page_number = next((segment["page_number"] for segment in self.questions_data if segment["id"] == segment_id), None)
+            page_number = next((segment["page_number"] for segment in questions_data if segment["id"] == segment_id), None)
         else:
             page_number = None
             segment_text = None
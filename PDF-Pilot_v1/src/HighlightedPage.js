@@ -0,0 +1,116 @@
+import React, { useEffect, useRef, useState } from 'react';
+import { Box } from '@mui/material';
+import { styled } from '@mui/system';
+import * as pdfjsLib from 'pdfjs-dist';
+
+pdfjsLib.GlobalWorkerOptions.workerSrc = new URL(
+  'pdfjs-dist/build/pdf.worker.min.js',
+  import.meta.url
+).toString();
+
+const PageContainer = styled(Box)({
+  position: 'relative',
+  marginTop: '2rem',
+  width: '100%',
+});
+
+const PageCanvas = styled('canvas')({
+  display: 'block',
+  width: '100%',
+});
+
+const PagePreview = styled('img')({
+  display: 'block',
+  width: '100%',
+});
+
+const HighlightRect = styled('div')({
+  position: 'absolute',
+  backgroundColor: 'rgba(255, 235, 59, 0.45)',
+  pointerEvents: 'none',
+});
+
+// Renders one page of the locally uploaded PDF and draws the highlight
+// rectangles returned by the server on top of it. Rects are in PDF points
+// relative to the page size the server reported, so they are drawn as
+// percentages and scale with the canvas. Until the page is rendered (or if
+// rendering fails) the server's pre-highlighted page image is shown instead.
+const HighlightedPage = ({ file, pageNumber, highlights, previewURL }) => {
+  const canvasRef = useRef(null);
+  const [error, setError] = useState(null);
+  const [rendered, setRendered] = useState(false);
+
+  useEffect(() => {
+    let cancelled = false;
+    let pdf = null;
+
+    const renderPage = async () => {
+      try {
+        const data = await file.arrayBuffer();
+        pdf = await pdfjsLib.getDocument({ data }).promise;
+        const page = await pdf.getPage(pageNumber);
+        const canvas = canvasRef.current;
+        if (cancelled || !canvas) {
+          return;
+        }
+        const scale = (canvas.clientWidth * window.devicePixelRatio) / page.getViewport({ scale: 1 }).width;
+        const viewport = page.getViewport({ scale });
+        canvas.width = viewport.width;
+        canvas.height = viewport.height;
+        await page.render({ canvasContext: canvas.getContext('2d'), viewport }).promise;
+        if (!cancelled) {
+          setRendered(true);
+        }
+      } catch (err) {
+        console.error('Error rendering PDF page', err);
+        setError(err);
+      }
+    };
+
+    setError(null);
+    setRendered(false);
+    renderPage();
+    return () => {
+      cancelled = true;
+      if (pdf) {
+        pdf.destroy();
+      }
+    };
+  }, [file, pageNumber]);
+
+  if (error) {
+    return previewURL ? (
+      <PageContainer>
+        <PagePreview src={previewURL} alt={`Page ${pageNumber}`} />
+      </PageContainer>
+    ) : null;
+  }
+
+  const pageHighlights = highlights.find((highlight) => highlight.page_number === pageNumber);
+  const showPreview = !rendered && previewURL;
+
+  return (
+    <PageContainer>
+      {showPreview && <PagePreview src={previewURL} alt={`Page ${pageNumber}`} />}
+      <PageCanvas
+        ref={canvasRef}
+        style={showPreview ? { position: 'absolute', top: 0, left: 0, visibility: 'hidden' } : undefined}
+      />
+      {rendered &&
+        pageHighlights &&
+        pageHighlights.rects.map(([x0, y0, x1, y1], index) => (
+          <HighlightRect
+            key={index}
+            style={{
+              left: `${(x0 / pageHighlights.width) * 100}%`,
+              top: `${(y0 / pageHighlights.height) * 100}%`,
+              width: `${((x1 - x0) / pageHighlights.width) * 100}%`,
+              height: `${((y1 - y0) / pageHighlights.height) * 100}%`,
+            }}
+          />
+        ))}
+    </PageContainer>
+  );
+};
+
+export default HighlightedPage;
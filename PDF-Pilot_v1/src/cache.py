@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Small thread-safe least-recently-used cache shared by the server's
+    # per-document stores. on_evict(key, value) is called for evicted entries.
+    # With max_bytes set, values must support len() and the cache also keeps
+    # their total length under max_bytes.
+    def __init__(self, maxsize=32, on_evict=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            if self.max_bytes is not None:
+                if key in self._data:
+                    self._bytes -= len(self._data[key])
+                self._bytes += len(value)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1):
+                evicted_key, evicted_value = self._data.popitem(last=False)
+                if self.max_bytes is not None:
+                    self._bytes -= len(evicted_value)
+                evicted.append((evicted_key, evicted_value))
+        if self.on_evict:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
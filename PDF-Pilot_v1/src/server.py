@@ -6,60 +6,320 @@ This file contains a Flask web application that serves as the backend for a chat
 The server provides the following API endpoints:
 
 1. '/chatbot' (POST) - Receives a user's question and a PDF file, processes the PDF using the HandoutAssistant class, 
-    and returns the answer along with a highlighted PDF containing the relevant segment.
+    and returns the answer along with the rectangles to highlight for the relevant segment (page number, page size
+    and [x0, y0, x1, y1] rects in PDF points). Send highlight_mode=pdf to get a full highlighted PDF copy instead.
     
-2. '/download_highlighted_pdf' (GET) - Allows the user to download the highlighted PDF generated by the '/chatbot' endpoint.
+2. '/download_highlighted_pdf' (GET) - Generates and downloads the highlighted PDF for a previous answer, given the
+    'document_id' and 'segment_key' returned by the '/chatbot' endpoint.
+
+3. '/page_image' (GET) - Renders one page of a previously uploaded PDF, with the answer's segment highlighted, to PNG
+    or WebP at the requested DPI. Renders are cached, and pages holding frequently retrieved segments are pre-rendered.
+
+4. '/metrics' (GET) - Latency and error counters for each upstream service (AI21, OpenAI embeddings and completions).
 
 The Flask app uses CORS to handle cross-origin resource sharing and communicates with the HandoutAssistant to process the PDFs and answer the questions.
+
+Heavy backends (PyMuPDF, OpenAI, LangChain, FAISS) are imported lazily on the first request. Set PDF_PILOT_PRELOAD=1 to
+load them at import time instead, e.g. when running under a pre-forking server such as `gunicorn --preload -w 4 server:app`,
+so every forked worker shares the already-initialized assistant and starts serving immediately.
 """
 
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-from HandoutAssistant import HandoutAssistant, PDFHandler
+from HandoutAssistant import HandoutAssistant, PDFHandler, InvalidPDFError
+from cache import LRUCache
+from upstream import UpstreamError, upstream_metrics
+from singleflight import SingleFlightTimeout
+from flask import Request
+import io
 import os
 import uuid
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 load_dotenv()
 
+MB = 1024 * 1024
+# Uploads up to this size are kept in memory, larger ones are spooled to a temporary file.
+SPOOL_UPLOAD_SIZE = int(float(os.environ.get('PDF_PILOT_SPOOL_UPLOAD_MB', 10)) * MB)
+# Requests larger than this are rejected with 413 before the body is read.
+MAX_UPLOAD_MB = float(os.environ.get('PDF_PILOT_MAX_UPLOAD_MB', 50))
+MAX_UPLOAD_SIZE = int(MAX_UPLOAD_MB * MB)
+
+
+class PDFUploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Paths of file parts spooled to disk by this request; removed at teardown unless kept.
+        self.spooled_uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= SPOOL_UPLOAD_SIZE:
+            return io.BytesIO()
+        # Kept (delete=False) so a spooled PDF can stay in the document cache after the request closes its files.
+        stream = tempfile.NamedTemporaryFile('w+b', suffix='.pdf', prefix='pdf_pilot_', delete=False)
+        self.spooled_uploads.append(stream.name)
+        return stream
+
+    def keep_spooled(self, pdf):
+        # The document cache now owns this spooled file.
+        if pdf in self.spooled_uploads:
+            self.spooled_uploads.remove(pdf)
+
+
+def stored_upload(stream):
+    # Flask closes uploaded files when the request ends, so keep the bytes of an in-memory upload
+    # and the path of a spooled one.
+    if isinstance(stream, io.BytesIO):
+        return stream.getvalue()
+    return stream.name
+
+
+def remove_spooled_upload(pdf):
+    if isinstance(pdf, str):
+        try:
+            os.remove(pdf)
+        except FileNotFoundError:
+            pass
+
+
+def hash_upload(stream):
+    if isinstance(stream, io.BytesIO):
+        return hashlib.sha256(stream.getbuffer()).hexdigest()
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(MB), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
 app = Flask(__name__, static_url_path='/static', static_folder='static')
+app.request_class = PDFUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 CORS(app)
 
 os.makedirs('static/pdf', exist_ok=True)
 
 assistant = HandoutAssistant()
 
+if os.environ.get('PDF_PILOT_PRELOAD', '').lower() in ('1', 'true', 'yes'):
+    assistant.preload()
+
+# Recently uploaded PDFs, keyed by the SHA-256 of their content, so the highlighted copy can be generated on demand.
+# Each entry is {"pdf": bytes or spooled file path, "segments": {segment_key: segment_text}, "hits": Counter of
+# segment_key, "users": int, "evicted": bool}. Segment ids change when a document is re-ingested, so answered segments
+# are keyed by a hash of their text. "users" counts the requests and background renders using the entry; the
+# spooled file of an evicted entry is only removed once the last of them releases it.
+documents_lock = threading.RLock()
+
+def evict_document(document_id, document):
+    with documents_lock:
+        document["evicted"] = True
+        if document["users"] == 0:
+            remove_spooled_upload(document["pdf"])
+
+def release_document(document):
+    with documents_lock:
+        document["users"] -= 1
+        if document["evicted"] and document["users"] == 0:
+            remove_spooled_upload(document["pdf"])
+
+documents = LRUCache(maxsize=int(os.environ.get('PDF_PILOT_MAX_DOCUMENTS', 32)), on_evict=evict_document)
+
+@contextmanager
+def use_document(document_id, pdf=None):
+    # Yields the stored document (storing pdf, as returned by stored_upload, first if it is not stored yet) or None,
+    # and keeps its PDF from being removed by eviction until the block exits.
+    with documents_lock:
+        document = documents.get(document_id)
+        if document is None and pdf is not None:
+            document = {"pdf": pdf, "segments": {}, "hits": Counter(), "users": 0, "evicted": False}
+            request.keep_spooled(document["pdf"])
+            documents.set(document_id, document)
+        if document is not None:
+            document["users"] += 1
+    try:
+        yield document
+    finally:
+        if document is not None:
+            release_document(document)
+
+# Rendered page images, keyed by (document_id, page, segment_key, dpi, format).
+page_images = LRUCache(maxsize=int(os.environ.get('PDF_PILOT_PAGE_CACHE_SIZE', 256)),
+                       max_bytes=int(float(os.environ.get('PDF_PILOT_PAGE_CACHE_MB', 64)) * MB))
+DEFAULT_DPI = 110
+MIN_DPI, MAX_DPI = 36, 300
+# Pre-render the answer page at the default DPI once a segment has been retrieved this many times (0 disables).
+PRERENDER_AFTER = int(os.environ.get('PDF_PILOT_PRERENDER_AFTER', 3))
+segment_hits_lock = threading.Lock()
+prerender_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prerender')
+
+def segment_key(segment_text):
+    return hashlib.sha256(segment_text.encode()).hexdigest()[:16]
+
+def get_page_image(document_id, document, page, segment, dpi, image_format):
+    key = (document_id, page, segment, dpi, image_format)
+    image = page_images.get(key)
+    if image is None:
+        image = PDFHandler.render_page(document["pdf"], page, document["segments"][segment], dpi, image_format)
+        page_images.set(key, image)
+    return image, key
+
+def record_segment_hit(document_id, document, page, segment):
+    # Hits are kept on the document, so they are dropped when it is evicted.
+    with segment_hits_lock:
+        document["hits"][segment] += 1
+        hits = document["hits"][segment]
+    if PRERENDER_AFTER and hits == PRERENDER_AFTER:
+        with documents_lock:
+            document["users"] += 1
+        prerender_executor.submit(prerender_page_image, document_id, document, page, segment)
+
+def prerender_page_image(document_id, document, page, segment):
+    try:
+        get_page_image(document_id, document, page, segment, DEFAULT_DPI, 'png')
+    finally:
+        release_document(document)
+
+@app.teardown_request
+def remove_unused_uploads(exc):
+    # Spooled file parts that were not stored (other fields, duplicates, rejected requests) are removed here.
+    for path in getattr(request, 'spooled_uploads', ()):
+        remove_spooled_upload(path)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"PDF is larger than {MAX_UPLOAD_MB:g} MB"}), 413
+
+@app.errorhandler(InvalidPDFError)
+def invalid_pdf(e):
+    print(f"Invalid PDF upload: {e}")
+    return jsonify({"error": "The uploaded file is not a valid PDF"}), 400
+
+@app.errorhandler(UpstreamError)
+def upstream_unavailable(e):
+    print(f"Upstream error: {e}")
+    return jsonify({"error": "An upstream service is unavailable, please try again shortly"}), 503
+
+@app.errorhandler(SingleFlightTimeout)
+def coalesced_request_timeout(e):
+    print(f"Coalesced request timed out: {e}")
+    return jsonify({"error": "The same PDF or question is still being processed, please try again shortly"}), 504
+
 @app.route('/chatbot', methods=['POST'])
 def chatbot():
     print("Request received.")
     question = request.form.get('question')
     file = request.files.get('file')
+    highlight_mode = request.form.get('highlight_mode', 'rects')
 
     if not question or not file:
         return jsonify({"error": "Missing question or file"}), 400
 
-    pdf_path = 'temp_pdf_file.pdf'
-    file.save(pdf_path)
+    document_id = hash_upload(file.stream)
+    pdf = stored_upload(file.stream)
+    # Parse the PDF once, before it is cached (so invalid uploads are rejected with 400 without taking a cache
+    # entry), and share it between text extraction and highlighting.
+    with PDFHandler.document(pdf) as doc, use_document(document_id, pdf) as document:
+        answer, segment_id, segment_text, page_number = assistant.process_pdf_and_get_answer(
+            doc, question, document_id=document_id)
+        print("process_pdf_and_get_answer")
+
+        if answer and segment_id and not segment_text:
+            # The model cited a segment that was not among the retrieved ones, so there is nothing to highlight.
+            print("Answer cites an unretrieved segment:", segment_id)
+            return jsonify({'answer': answer, 'page_number': page_number})
+
+        if answer and segment_id:
+            print("OpenAI API Response:", answer)
+            print("\nAnswer: ", answer)
+            segment = segment_key(segment_text)
+            document["segments"][segment] = segment_text
+
+            if highlight_mode == 'pdf':
+                highlighted_pdf_path = f'static/pdf/highlighted_{uuid.uuid4().hex}.pdf'
+                PDFHandler.highlight_text(doc, highlighted_pdf_path, segment_text)
+
+                return jsonify({
+                    'answer': answer,
+                    'highlighted_pdf_path': highlighted_pdf_path,
+                    'page_number': page_number
+                })
+
+            page_image_path = None
+            if page_number is not None:
+                record_segment_hit(document_id, document, page_number, segment)
+                page_image_query = urlencode({'document_id': document_id, 'page': page_number, 'segment': segment})
+                page_image_path = f'page_image?{page_image_query}'
+
+            return jsonify({
+                'answer': answer,
+                'page_number': page_number,
+                'document_id': document_id,
+                'segment_id': segment_id,
+                'segment_key': segment,
+                'highlights': PDFHandler.find_highlights(doc, segment_text),
+                'page_image_path': page_image_path
+            })
+
+    print("No answer found.")
+    return jsonify({"answer": "No answer found"})
+
+@app.route('/download_highlighted_pdf', methods=['GET'])
+def download_highlighted_pdf():
+    document_id = request.args.get('document_id')
+    segment = request.args.get('segment')
+
+    with use_document(document_id) as document:
+        if document is None or segment not in document["segments"]:
+            return jsonify({"error": "Unknown document or segment, ask the question again"}), 404
+
+        output = io.BytesIO()
+        PDFHandler.highlight_text(document["pdf"], output, document["segments"][segment])
+    output.seek(0)
+    return send_file(output, mimetype='application/pdf', as_attachment=True,
+                     download_name=f'highlighted_{document_id[:12]}_{segment[:8]}.pdf')
+
+@app.route('/page_image', methods=['GET'])
+def page_image():
+    document_id = request.args.get('document_id')
+    page = request.args.get('page', type=int)
+    segment = request.args.get('segment')
+    dpi = request.args.get('dpi', DEFAULT_DPI, type=int)
+    image_format = request.args.get('format', 'png').lower()
 
-    answer, segment_id, segment_text, page_number = assistant.process_pdf_and_get_answer(pdf_path, question)
-    print("process_pdf_and_get_answer")
+    if image_format not in ('png', 'webp'):
+        return jsonify({"error": "format must be png or webp"}), 400
+    if page is None or page < 1:
+        return jsonify({"error": "Missing or invalid page"}), 400
 
-    if answer and segment_id:
-        highlighted_pdf_path = f'static/pdf/highlighted_{uuid.uuid4().hex}.pdf'
-        PDFHandler.highlight_text(pdf_path, highlighted_pdf_path, segment_text)
+    dpi = min(max(dpi, MIN_DPI), MAX_DPI)
+    with use_document(document_id) as document:
+        if document is None or segment not in document["segments"]:
+            return jsonify({"error": "Unknown document or segment, ask the question again"}), 404
+        try:
+            image, key = get_page_image(document_id, document, page, segment, dpi, image_format)
+        except IndexError:
+            return jsonify({"error": "Page is not in the document"}), 400
+        except ImportError:
+            return jsonify({"error": "WebP rendering needs Pillow, request format=png"}), 400
 
-        print("OpenAI API Response:", answer)
-        print("\nAnswer: ", answer)
-        os.remove(pdf_path)
+    # The same URL can render a different highlight after the document is re-ingested, so clients revalidate
+    # against an ETag derived from the cache key instead of caching the image indefinitely.
+    etag = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+    response = send_file(io.BytesIO(image), mimetype=f'image/{image_format}', etag=etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-        return jsonify({
-            'answer': answer,
-            'highlighted_pdf_path': highlighted_pdf_path,
-            'page_number': page_number
-        })
-    else:
-        os.remove(pdf_path)
-        print("No answer found.")
-        return jsonify({"answer": "No answer found"})
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({'upstreams': upstream_metrics()})
 
 if __name__ == '__main__':
-    app.run(port=5001)
+    app.run(port=int(os.environ.get('PORT', 5001)))
@@ -0,0 +1,45 @@
+from cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    evicted = []
+    cache = LRUCache(maxsize=2, on_evict=lambda key, value: evicted.append(key))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+    assert len(cache) == 2
+
+
+def test_max_bytes_evicts_until_under_the_limit():
+    evicted = []
+    cache = LRUCache(maxsize=10, max_bytes=100, on_evict=lambda key, value: evicted.append(key))
+    cache.set("a", b"x" * 40)
+    cache.set("b", b"x" * 40)
+    cache.set("c", b"x" * 40)
+
+    assert evicted == ["a"]
+    assert cache._bytes == 80
+
+
+def test_max_bytes_accounts_for_replaced_values():
+    cache = LRUCache(maxsize=10, max_bytes=100)
+    cache.set("a", b"x" * 60)
+    cache.set("a", b"x" * 10)
+    cache.set("b", b"x" * 80)
+
+    assert "a" in cache and "b" in cache
+    assert cache._bytes == 90
+
+
+def test_oversized_value_is_kept_alone():
+    cache = LRUCache(maxsize=10, max_bytes=100)
+    cache.set("a", b"x" * 10)
+    cache.set("big", b"x" * 500)
+
+    assert "a" not in cache
+    assert cache.get("big") == b"x" * 500
+    assert len(cache) == 1
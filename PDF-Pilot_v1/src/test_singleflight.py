@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight, SingleFlightTimeout
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    def call():
+        return flight.do("key", fn)
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(5, call)
+
+    assert len(calls) == 1
+    assert results == ["result"] * 5
+    assert errors == [None] * 5
+    assert flight.in_flight() == 0
+
+
+def test_error_is_raised_in_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("ingestion failed")
+
+    threading.Timer(0.2, release.set).start()
+    _, errors = run_concurrently(4, lambda: flight.do("key", fn))
+
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.in_flight() == 0
+
+
+def test_waiter_times_out_while_leader_keeps_running():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    leader_result = []
+
+    def fn():
+        started.set()
+        release.wait(5)
+        return "late"
+
+    leader = threading.Thread(target=lambda: leader_result.append(flight.do("key", fn)))
+    leader.start()
+    started.wait(5)
+
+    with pytest.raises(SingleFlightTimeout):
+        flight.do("key", lambda: "not run", timeout=0.05)
+
+    release.set()
+    leader.join(5)
+    assert leader_result == ["late"]
+
+
+def test_key_is_forgotten_after_the_call():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do("key", fn) == 1
+    assert flight.do("key", fn) == 2
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+    # both calls must be running at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def call(key):
+        flight.do(key, barrier.wait)
+
+    threads = [threading.Thread(target=call, args=(key,)) for key in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert not barrier.broken
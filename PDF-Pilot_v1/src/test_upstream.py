@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Developers", "Benchmarks"))
+
+from fake_upstreams import FakeUpstreams, LatencyProfile  # noqa: E402
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamError, UpstreamTimeout  # noqa: E402
+
+
+class SequenceProfile(LatencyProfile):
+    # Fake-upstream latency profile that returns the given delays (seconds) in
+    # order, then the last one for every further request.
+    def __init__(self, *delays):
+        super().__init__()
+        self.delays = list(delays)
+
+    def sample_delay(self):
+        return self.delays.pop(0) if len(self.delays) > 1 else self.delays[0]
+
+
+@pytest.fixture
+def upstreams():
+    upstreams = FakeUpstreams().start()
+    yield upstreams
+    upstreams.stop()
+
+
+def complete(upstreams):
+    url = f"http://127.0.0.1:{upstreams.port}/v1/completions"
+
+    def post(timeout):
+        try:
+            response = requests.post(url, json={"prompt": 'Question: ?\n1. "Fake segment."'}, timeout=timeout)
+        except requests.Timeout as e:
+            raise UpstreamTimeout(f"fake upstream timed out: {e}") from e
+        except requests.RequestException as e:
+            raise UpstreamError(f"fake upstream request failed: {e!r}") from e
+        if response.status_code != 200:
+            raise UpstreamError(f"fake upstream returned {response.status_code}")
+        return response.json()["choices"][0]["text"]
+    return post
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_reset():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # only the one trial call is let through
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_half_open_trial_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+    assert breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_skipped_half_open_trial_lets_the_next_call_try_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+    breaker.record_skipped()
+    assert breaker.state == "open"
+    assert breaker.allow()
+
+
+def test_successful_call(upstreams):
+    client = UpstreamClient("test", timeout=5)
+    assert client.call(complete(upstreams)).startswith("Answer:")
+    metrics = client.metrics()
+    assert metrics["successes"] == 1
+    assert metrics["latency_p50_ms"] is not None
+
+
+def test_hedged_attempt_wins_over_a_straggler(upstreams):
+    upstreams.profiles["completions"] = SequenceProfile(2.0, 0.0)
+    client = UpstreamClient("test", timeout=5, hedge_min_samples=1)
+    client.latencies.add(0.05)
+
+    start = time.monotonic()
+    client.call(complete(upstreams))
+
+    assert time.monotonic() - start < 1.0
+    metrics = client.metrics()
+    assert metrics["hedges"] == 1
+    assert metrics["hedge_wins"] == 1
+
+
+def test_no_hedge_when_disabled(upstreams):
+    upstreams.profiles["completions"] = SequenceProfile(0.3, 0.0)
+    client = UpstreamClient("test", timeout=5, hedge_quantile=None, hedge_min_samples=1)
+    client.latencies.add(0.01)
+
+    client.call(complete(upstreams))
+
+    assert client.metrics()["hedges"] == 0
+    assert upstreams.requests["completions"] == 1
+
+
+def test_deadline_turns_a_straggler_into_a_timeout(upstreams):
+    upstreams.profiles["completions"] = SequenceProfile(2.0)
+    client = UpstreamClient("test", timeout=0.2, retries=0, hedge_quantile=None)
+
+    start = time.monotonic()
+    with pytest.raises(UpstreamTimeout):
+        client.call(complete(upstreams))
+
+    assert time.monotonic() - start < 1.0
+    assert client.metrics()["timeouts"] == 1
+
+
+def test_outage_is_retried_then_opens_the_circuit(upstreams):
+    upstreams.profiles["completions"] = LatencyProfile(error_rate=1.0)
+    client = UpstreamClient("test", timeout=5, retries=2, backoff=0.01, failure_threshold=2, reset_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.call(complete(upstreams))
+    assert upstreams.requests["completions"] == 6
+    assert client.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        client.call(complete(upstreams))
+    assert client.call(complete(upstreams), fallback=lambda error: "cached") == "cached"
+    assert upstreams.requests["completions"] == 6
+    assert client.metrics()["rejected"] == 2
+
+
+def test_non_retryable_error_is_not_retried_and_keeps_the_circuit_closed():
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise UpstreamError("invalid request (400)", retryable=False)
+
+    client = UpstreamClient("test", timeout=5, backoff=0.01, failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            client.call(fn)
+
+    assert len(calls) == 3
+    assert client.breaker.state == "closed"
+
+
+def test_local_error_is_raised_unchanged_without_retries():
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise RuntimeError("tokenizer download failed")
+
+    client = UpstreamClient("test", timeout=5, backoff=0.01, failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            client.call(fn)
+
+    assert len(calls) == 3
+    assert client.breaker.state == "closed"
+    assert client.metrics()["retries"] == 0
@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class UpstreamError(Exception):
+    # retryable=False for errors a retry cannot fix (e.g. a 4xx response).
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class UpstreamTimeout(UpstreamError, TimeoutError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, message):
+        super().__init__(message, retryable=False)
+
+
+class LatencyTracker:
+    # Latencies (seconds) of the most recent successful calls.
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and fails fast for
+    # reset_timeout seconds, then lets one trial call through (half-open):
+    # success closes the circuit again, failure re-opens it.
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_skipped(self):
+        # The call failed locally without telling us anything about the
+        # upstream; a half-open trial goes back to open so the next call
+        # can try again.
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def record_failure(self):
+        # Returns True when this failure opened the circuit.
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                opened = self.state != "open"
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return opened
+            return False
+
+
+class UpstreamClient:
+    # Wraps calls to one upstream service (AI21, OpenAI completions, ...).
+    #
+    # call(fn) runs fn(timeout) with an overall deadline of `timeout` seconds;
+    # fn must pass the timeout it is given on to its HTTP library and raise
+    # UpstreamError for failures of the upstream itself. Any other exception
+    # is treated as a local error: it is raised unchanged, without retries,
+    # and does not count towards the circuit breaker. Failed attempts are
+    # retried with jittered exponential backoff while the deadline allows. If
+    # an attempt is slower than the recent p95 latency a duplicate (hedged)
+    # attempt is started and the first success wins. A circuit breaker fails
+    # fast while the upstream is down, returning fallback(error) instead when
+    # a fallback is given.
+    def __init__(self, name, timeout=30.0, retries=2, backoff=0.5, hedge_quantile=0.95, hedge_min_samples=20,
+                 max_concurrency=8, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = LatencyTracker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # one extra worker per slot so hedges are not queued behind stuck attempts
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix=f"upstream-{name}")
+        self._counters = {counter: 0 for counter in (
+            "calls", "successes", "failures", "timeouts", "retries", "hedges", "hedge_wins", "rejected", "fallbacks")}
+        self._counter_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name, **defaults):
+        # PDF_PILOT_<NAME>_TIMEOUT, _RETRIES, _MAX_CONCURRENCY, _FAILURE_THRESHOLD, _RESET_TIMEOUT
+        # and _HEDGE_QUANTILE override the defaults (name "openai-completions" -> OPENAI_COMPLETIONS).
+        prefix = "PDF_PILOT_" + name.upper().replace("-", "_") + "_"
+        settings = {"timeout": float, "retries": int, "max_concurrency": int, "failure_threshold": int,
+                    "reset_timeout": float, "hedge_quantile": float}
+        for setting, parse in settings.items():
+            value = os.environ.get(prefix + setting.upper())
+            if value:
+                defaults[setting] = parse(value)
+        return cls(name, **defaults)
+
+    def _count(self, counter, amount=1):
+        with self._counter_lock:
+            self._counters[counter] += amount
+
+    def hedge_delay(self):
+        if not self.hedge_quantile or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return self.latencies.quantile(self.hedge_quantile)
+
+    def call(self, fn, fallback=None):
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            return self._fail(CircuitOpenError(f"{self.name} is unavailable (circuit open)"), fallback)
+
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(fn, deadline)
+            except UpstreamError as e:
+                error = e
+            except Exception:
+                self.breaker.record_skipped()
+                self._count("failures")
+                raise
+            else:
+                self.breaker.record_success()
+                self._count("successes")
+                return result
+
+            remaining = deadline - time.monotonic()
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if not error.retryable or attempt >= self.retries or delay >= remaining:
+                break
+            attempt += 1
+            self._count("retries")
+            time.sleep(delay)
+
+        self._count("failures")
+        if isinstance(error, UpstreamTimeout):
+            self._count("timeouts")
+        if not error.retryable:
+            # the upstream answered (e.g. with a 4xx), so it is not degraded
+            self.breaker.record_success()
+        elif self.breaker.record_failure():
+            print(f"Circuit for upstream {self.name} opened after {self.breaker.failures} failures")
+        return self._fail(error, fallback)
+
+    def _fail(self, error, fallback):
+        if fallback is None:
+            raise error
+        self._count("fallbacks")
+        return fallback(error)
+
+    def _attempt(self, fn, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not self._slots.acquire(timeout=remaining):
+            raise UpstreamTimeout(f"{self.name}: no free connection slot before the deadline")
+
+        pending = {self._submit(fn, deadline)}
+        hedge = None
+        hedge_delay = self.hedge_delay()
+        last_error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = min(remaining, hedge_delay) if hedge is None and hedge_delay is not None else remaining
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if future is hedge:
+                    self._count("hedge_wins")
+                return result
+            # Hedge once, only while the original attempt is still running and a slot is free.
+            if hedge is None and hedge_delay is not None and pending and self._slots.acquire(blocking=False):
+                self._count("hedges")
+                hedge = self._submit(fn, deadline)
+                pending.add(hedge)
+
+        if pending or last_error is None:
+            raise UpstreamTimeout(f"{self.name} did not respond within {self.timeout}s")
+        raise last_error
+
+    def _submit(self, fn, deadline):
+        def run():
+            try:
+                start = time.monotonic()
+                result = fn(max(deadline - start, 0.001))
+                self.latencies.add(time.monotonic() - start)
+                return result
+            finally:
+                self._slots.release()
+        return self._executor.submit(run)
+
+    def metrics(self):
+        with self._counter_lock:
+            metrics = dict(self._counters)
+        metrics["circuit"] = self.breaker.state
+        for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            latency = self.latencies.quantile(q)
+            metrics[f"latency_{label}_ms"] = round(latency * 1000, 1) if latency is not None else None
+        return metrics
+
+
+# Shared clients, created on first use so settings can come from the environment.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_upstream(name, **defaults):
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = UpstreamClient.from_env(name, **defaults)
+        return _clients[name]
+
+
+def upstream_metrics():
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.name: client.metrics() for client in clients}
@@ -0,0 +1,143 @@
+import os
+import math
+import tempfile
+import uuid
+
+# numpy and faiss are imported inside the methods that use them, like the
+# backends in HandoutAssistant.py.
+
+STORAGE_MODES = ("flat", "fp16", "sq8", "pq")
+
+
+class CompressedVectorIndex:
+    # In-memory FAISS index over segment embeddings with compressed vector
+    # storage, used instead of langchain's flat float32 store when
+    # PDF_PILOT_VECTOR_STORAGE is set:
+    #
+    #   flat  float32, 4 bytes per dimension (same as langchain.FAISS)
+    #   fp16  float16 scalar quantizer, 2 bytes per dimension
+    #   sq8   8-bit scalar quantizer, 1 byte per dimension
+    #   pq    product quantization, pq_bytes bytes per vector (default d / 8)
+    #
+    # With rerank > 0 the full float32 vectors are written to disk and the
+    # top k * rerank candidates from the compressed index are re-ranked
+    # exactly against them (memory-mapped, so they are not kept in RAM).
+    def __init__(self, vectors, documents, embedder=None, storage="fp16", pq_bytes=None, rerank=0, vectors_dir=None):
+        import numpy as np
+        import faiss
+
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage {storage!r}, expected one of {', '.join(STORAGE_MODES)}")
+
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self.documents = list(documents)
+        self.embedder = embedder
+        self.dimension = vectors.shape[1]
+        self.rerank = rerank
+        self.storage = storage
+        self.index = self._build_index(faiss, vectors, storage, pq_bytes)
+
+        self.vectors_path = None
+        self.originals = None
+        if rerank:
+            vectors_dir = vectors_dir or os.environ.get("PDF_PILOT_VECTOR_DIR") or tempfile.gettempdir()
+            os.makedirs(vectors_dir, exist_ok=True)
+            self.vectors_path = os.path.join(vectors_dir, f"pdf_pilot_vectors_{uuid.uuid4().hex}.npy")
+            np.save(self.vectors_path, vectors)
+            # Mapped once for the lifetime of the index. On POSIX the mapping
+            # outlives the file, so it is unlinked right away and nothing is
+            # left on disk when a worker exits without closing its indexes;
+            # elsewhere close() removes it.
+            self.originals = np.load(self.vectors_path, mmap_mode="r")
+            if os.name == "posix":
+                os.remove(self.vectors_path)
+                self.vectors_path = None
+
+    def _build_index(self, faiss, vectors, storage, pq_bytes):
+        count, dimension = vectors.shape
+        if storage == "flat":
+            index = faiss.IndexFlatL2(dimension)
+        elif storage == "fp16":
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+        elif storage == "sq8":
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            # Training a PQ codebook of 2**nbits centroids wants ~39 points
+            # per centroid, so small documents get smaller codebooks and
+            # documents under ~600 segments fall back to sq8.
+            nbits = min(8, int(math.log2(count / 39))) if count >= 39 else 0
+            if nbits < 4:
+                self.storage = "sq8"
+                return self._build_index(faiss, vectors, "sq8", pq_bytes)
+            subquantizers = pq_bytes or dimension // 8
+            while dimension % subquantizers:
+                subquantizers -= 1
+            index = faiss.IndexPQ(dimension, subquantizers, nbits)
+
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        return index
+
+    @classmethod
+    def from_documents(cls, documents, embedder, **kwargs):
+        vectors = embedder.embed_documents([doc.page_content for doc in documents])
+        return cls(vectors, documents, embedder=embedder, **kwargs)
+
+    @classmethod
+    def from_env(cls, documents, embedder):
+        pq_bytes = os.environ.get("PDF_PILOT_VECTOR_PQ_BYTES")
+        return cls.from_documents(
+            documents,
+            embedder,
+            storage=os.environ.get("PDF_PILOT_VECTOR_STORAGE", "fp16"),
+            pq_bytes=int(pq_bytes) if pq_bytes else None,
+            rerank=int(os.environ.get("PDF_PILOT_VECTOR_RERANK", 0)),
+        )
+
+    def memory_bytes(self):
+        # Encoded vectors plus the trained tables stored with them (the PQ
+        # codebook, the scalar quantizer's per-dimension ranges).
+        import faiss
+        total = self.index.code_size * self.index.ntotal
+        if isinstance(self.index, faiss.IndexPQ):
+            total += faiss.vector_to_array(self.index.pq.centroids).nbytes
+        elif isinstance(self.index, faiss.IndexScalarQuantizer):
+            total += faiss.vector_to_array(self.index.sq.trained).nbytes
+        return total
+
+    def search_vectors(self, query_vectors, k):
+        # Returns (distances, ids) like faiss, re-ranked when enabled.
+        import numpy as np
+
+        query_vectors = np.ascontiguousarray(query_vectors, dtype="float32")
+        k = min(k, self.index.ntotal)
+        if not self.rerank:
+            return self.index.search(query_vectors, k)
+
+        distances, ids = self.index.search(query_vectors, min(k * self.rerank, self.index.ntotal))
+        originals = self.originals
+        exact_distances = np.full((len(query_vectors), k), np.inf, dtype="float32")
+        exact_ids = np.full((len(query_vectors), k), -1, dtype="int64")
+        for row, (query, candidates) in enumerate(zip(query_vectors, ids)):
+            # sorted ids keep the reads from the memory-mapped file sequential
+            candidates = np.sort(candidates[candidates >= 0])
+            candidate_distances = ((originals[candidates] - query) ** 2).sum(axis=1)
+            order = np.argsort(candidate_distances)[:k]
+            exact_ids[row, :len(order)] = candidates[order]
+            exact_distances[row, :len(order)] = candidate_distances[order]
+        return exact_distances, exact_ids
+
+    def similarity_search_with_score(self, query, k=4):
+        distances, ids = self.search_vectors([self.embedder.embed_query(query)], k)
+        return [(self.documents[i], float(distance)) for distance, i in zip(distances[0], ids[0]) if i >= 0]
+
+    def similarity_search(self, query, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def close(self):
+        # Removes the vectors file if it is still there; the mapping stays
+        # valid until the index itself is released, so concurrent searches
+        # are unaffected.
+        if self.vectors_path and os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)